@@ -1,25 +1,33 @@
 import datetime
 import logging
-import re
 import smtplib
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import urlencode
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.contrib.sites.models import Site
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.management.base import BaseCommand, CommandError
 from django.template import loader
+from django.urls import reverse
 from django.utils.timezone import now
-from oscar.core.loading import get_class, get_classes
 
-from hyperpay.processors import HyperPay, HyperPayMada
+from hyperpay.reports import REPORT_DURATION, REPORT_MAX_DURATION, iter_manual_review_records
 
 logger = logging.getLogger(__name__)
-PaymentProcessorResponse = get_class("payment.models", "PaymentProcessorResponse")
 
-REPORT_DUARATION = 5
-# Hyperpay result codes for manual review can be found at
-# https://hyperpay.docs.oppwa.com/reference/resultCodes#successful under the section
-# "Result codes for successfully processed transactions that should be manually reviewed"
-SUCCESS_MANUAL_REVIEW_CODES_REGEX = re.compile(r'^(000\.400\.0[^3]|000\.400\.[0-1]{2}0)')
+
+@lru_cache(maxsize=None)
+def get_report_templates():
+    """
+    Return the HTML and text templates of the report, loading them only once per process.
+    """
+    return (
+        loader.get_template("payment/hyperpay_report.html"),
+        loader.get_template("payment/hyperpay_report.txt"),
+    )
 
 
 class Command(BaseCommand):
@@ -34,9 +42,11 @@ class Command(BaseCommand):
         parser.add_argument(
             "-d",
             "--duration",
-            default=REPORT_DUARATION,
+            default=REPORT_DURATION,
             type=int,
-            help="Duration in hours to check the past records from now. Defaults to %s" % REPORT_DUARATION
+            help="Duration in hours to check the past records from now, at most %s. Defaults to %s" % (
+                REPORT_MAX_DURATION, REPORT_DURATION
+            )
         )
         parser.add_argument(
             "-e",
@@ -45,6 +55,12 @@ class Command(BaseCommand):
             nargs="+",
             help="The email addresses to which the report will be sent."
         )
+        parser.add_argument(
+            "-u",
+            "--base-url",
+            help="The base URL of the ecommerce service, used to link to the detailed report from the email. "
+                 "Defaults to the URL of the current site."
+        )
 
     def handle(self, *args, **options):
         """
@@ -52,40 +68,67 @@ class Command(BaseCommand):
         """
         time_duration = options.get("duration")
         recipient_list = options.get("emails")
-        actionable_payment_responses = []
-        past_responses = PaymentProcessorResponse.objects.filter(
-            processor_name__in=[HyperPay.NAME, HyperPayMada.NAME],
-            created__gte=now() - datetime.timedelta(hours=time_duration)
-        )
-        for response in past_responses:
-            result_code = response.response["result"]["code"]
-            if SUCCESS_MANUAL_REVIEW_CODES_REGEX.search(result_code):
-                actionable_payment_responses.append(response)
+        # The detailed report does not accept longer durations, so the email would link to another window.
+        if not 1 <= time_duration <= REPORT_MAX_DURATION:
+            raise CommandError("The duration must be between 1 and {} hours.".format(REPORT_MAX_DURATION))
+        processor_counts = Counter()
+        result_code_counts = Counter()
+        for _, processor_name, result_code in iter_manual_review_records(
+            now() - datetime.timedelta(hours=time_duration)
+        ):
+            processor_counts[processor_name] += 1
+            result_code_counts[result_code] += 1
+
+        total = sum(processor_counts.values())
+        logger.info("Found %s payment records requiring action", total)
+        if total:
+            summary = {
+                "total": total,
+                "duration": time_duration,
+                "processors": sorted(processor_counts.items()),
+                "result_codes": result_code_counts.most_common(),
+            }
+            report_url = self._get_report_url(options.get("base_url"), time_duration)
+            self._render_email_and_send(summary, recipient_list, report_url)
 
-        logger.info("Found %s payment records requiring action", len(actionable_payment_responses))
-        if actionable_payment_responses:
-            self._render_email_and_send(actionable_payment_responses, recipient_list)
+    def _get_report_url(self, base_url, time_duration):
+        """
+        Return the URL of the page listing the transactions requiring manual
+        verification, on the given base URL or else on the current site.
+        """
+        path = "{}?{}".format(reverse("hyperpay:manual-review-report"), urlencode({"duration": time_duration}))
+        if base_url:
+            return "{}{}".format(base_url.rstrip("/"), path)
+        try:
+            site_configuration = Site.objects.get_current().siteconfiguration
+        except ObjectDoesNotExist:
+            raise CommandError("The current site is not configured, pass the base URL of the service with --base-url.")
+        return site_configuration.build_ecommerce_url(path)
 
-    def _render_email_and_send(self, payment_reponses, recipient_list):
+    def _render_email_and_send(self, summary, recipient_list, report_url=None):
         """
-        Render email with all the transactions requiring manual verification
+        Render email with the summary of the transactions requiring manual verification
         and send the email
         """
-        html_template = loader.get_template("payment/hyperpay_report.html")
-        text_template = loader.get_template("payment/hyperpay_report.txt")
+        html_template, text_template = get_report_templates()
         context = {
-            "responses": payment_reponses
+            "summary": summary,
+            "report_url": report_url,
         }
         html_message = html_template.render(context)
         message = text_template.render(context)
 
         try:
-            send_mail(
-                from_email=settings.OSCAR_FROM_EMAIL,
-                subject="Action Required! Payment Report",
-                html_message=html_message,
-                message=message,
-                recipient_list=recipient_list
-            )
+            # A single connection is used so that all the messages are delivered within one SMTP session.
+            with get_connection() as connection:
+                email = EmailMultiAlternatives(
+                    subject="Action Required! Payment Report",
+                    body=message,
+                    from_email=settings.OSCAR_FROM_EMAIL,
+                    to=recipient_list,
+                    connection=connection
+                )
+                email.attach_alternative(html_message, "text/html")
+                connection.send_messages([email])
         except smtplib.SMTPException:
             logger.error("Failed to send email")
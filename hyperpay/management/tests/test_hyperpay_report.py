@@ -2,9 +2,11 @@ import datetime
 import logging
 from unittest.mock import patch
 
+from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.urls import reverse
 from django.utils.six import StringIO
 from django.utils.timezone import now
 from oscar.core.loading import get_class
@@ -12,6 +14,7 @@ from oscar.core.loading import get_class
 from ecommerce.extensions.payment.models import PaymentProcessorResponse
 from ecommerce.tests.testcases import TestCase
 from hyperpay.processors import HyperPay, HyperPayMada
+from hyperpay.reports import REPORT_MAX_DURATION
 
 PaymentProcessorResponse = get_class("payment.models", "PaymentProcessorResponse")
 
@@ -53,30 +56,61 @@ class HyperPayReportCommandTestCase(TestCase):
         self.assertLogs(level=logging.INFO)
         self.assertEqual(len(mail.outbox), 0)
 
+    def test_duration_is_limited(self):
+        """
+        Test that CommandError is raised if the duration is longer than the detailed report allows
+        """
+        with self.assertRaises(CommandError):
+            call_command('hyperpay_report', emails=["report1@example.com"], duration=REPORT_MAX_DURATION + 1)
+        with self.assertRaises(CommandError):
+            call_command('hyperpay_report', emails=["report1@example.com"], duration=0)
+
+    def test_responses_without_result_code_are_skipped(self):
+        """
+        Test that the responses which only contain a manual review code outside
+        of their result are not reported.
+        """
+        PaymentProcessorResponse.objects.bulk_create([
+            PaymentProcessorResponse(processor_name=HyperPay.NAME, response={"callback_get": {"id": "000.400.000"}}),
+            PaymentProcessorResponse(processor_name=HyperPayMada.NAME, response={"error": "000.400.000"}),
+        ])
+        call_command('hyperpay_report', emails=["report1@example.com"])
+        self.assertEqual(len(mail.outbox), 0)
+
 
 class HyperPayReportGenerationTestCase(TestCase):
 
     def setUp(self):
+        super(HyperPayReportGenerationTestCase, self).setUp()
+        # The email links to the detailed report on the current site by default.
+        site_settings = self.settings(SITE_ID=self.site.id)
+        site_settings.enable()
+        self.addCleanup(site_settings.disable)
+        Site.objects.clear_cache()
         self.stdout = StringIO()
         self.manual_review_response = {"result": {"code": "000.400.000"}}
-        self.hyperpay_manual_review_response = PaymentProcessorResponse.objects.create(
-            processor_name=HyperPay.NAME,
-            response=self.manual_review_response
-        )
-        self.mada_manual_review_response = PaymentProcessorResponse.objects.create(
-            processor_name=HyperPayMada.NAME,
-            response=self.manual_review_response
-        )
-        self.old_manual_review_response = PaymentProcessorResponse.objects.create(
-            processor_name=HyperPayMada.NAME,
-            response=self.manual_review_response,
+        PaymentProcessorResponse.objects.bulk_create([
+            PaymentProcessorResponse(processor_name=HyperPay.NAME, response=self.manual_review_response),
+            PaymentProcessorResponse(processor_name=HyperPayMada.NAME, response=self.manual_review_response),
+            PaymentProcessorResponse(processor_name=HyperPayMada.NAME, response=self.manual_review_response),
+        ])
+        # The primary keys are not set by bulk_create on all database backends, so fetch the records back.
+        (
+            self.hyperpay_manual_review_response,
+            self.mada_manual_review_response,
+            self.old_manual_review_response,
+        ) = PaymentProcessorResponse.objects.filter(
+            processor_name__in=[HyperPay.NAME, HyperPayMada.NAME]
+        ).order_by('id')
+        # `created` is set automatically on insert, so it can only be overridden afterwards.
+        PaymentProcessorResponse.objects.filter(id=self.old_manual_review_response.id).update(
+            created=now() - datetime.timedelta(hours=9)
         )
-        self.old_manual_review_response.created = now() - datetime.timedelta(hours=9)
-        self.old_manual_review_response.save()
 
     def tearDown(self):
-        self.hyperpay_manual_review_response.delete()
-        self.mada_manual_review_response.delete()
+        PaymentProcessorResponse.objects.filter(
+            id__in=[self.hyperpay_manual_review_response.id, self.mada_manual_review_response.id]
+        ).delete()
 
     def test_email_sent_if_actionable_responses_found(self):
         """
@@ -94,20 +128,55 @@ class HyperPayReportGenerationTestCase(TestCase):
         Test that passing duration allows filtering the records
         that timedelta.
         """
-        arguments_1 = (
-            [self.hyperpay_manual_review_response, self.mada_manual_review_response],
-            ['report1@example.com']
-        )
-        arguments_2 = (
-            [self.hyperpay_manual_review_response, self.mada_manual_review_response, self.old_manual_review_response],
-            ['report1@example.com']
-        )
+        report_path = reverse('hyperpay:manual-review-report')
         with patch(
             'hyperpay.management.commands.hyperpay_report.Command._render_email_and_send'
         ) as mock_method:
             # We should only get 2 records for 5 hour timedelta
             call_command('hyperpay_report', emails=["report1@example.com"])
-            mock_method.assert_called_with(*arguments_1)
+            mock_method.assert_called_with(
+                {
+                    'total': 2,
+                    'duration': 5,
+                    'processors': [(HyperPay.NAME, 1), (HyperPayMada.NAME, 1)],
+                    'result_codes': [('000.400.000', 2)],
+                },
+                ['report1@example.com'],
+                self.site.siteconfiguration.build_ecommerce_url('{}?duration=5'.format(report_path))
+            )
             # We should get 3 records now for 10 hours timedelta
             call_command('hyperpay_report', emails=["report1@example.com"], duration=10)
-            mock_method.assert_called_with(*arguments_2)
+            mock_method.assert_called_with(
+                {
+                    'total': 3,
+                    'duration': 10,
+                    'processors': [(HyperPay.NAME, 1), (HyperPayMada.NAME, 2)],
+                    'result_codes': [('000.400.000', 3)],
+                },
+                ['report1@example.com'],
+                self.site.siteconfiguration.build_ecommerce_url('{}?duration=10'.format(report_path))
+            )
+
+    def test_report_links_to_detailed_report_on_current_site(self):
+        """
+        Test that the email links to the detailed report on the current site
+        when the base URL of the service is not provided.
+        """
+        call_command('hyperpay_report', emails=["report1@example.com"])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(
+            '://{}{}?duration=5'.format(self.site.domain, reverse('hyperpay:manual-review-report')),
+            mail.outbox[0].body
+        )
+
+    def test_report_links_to_detailed_report(self):
+        """
+        Test that the email links to the detailed report when the base URL
+        of the service is provided.
+        """
+        call_command('hyperpay_report', emails=["report1@example.com"], base_url='https://ecommerce.example.com/')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(
+            'https://ecommerce.example.com{}?duration=5'.format(reverse('hyperpay:manual-review-report')),
+            mail.outbox[0].body
+        )
@@ -3,14 +3,19 @@ HyperPay payment processor.
 """
 
 import logging
+from functools import lru_cache
+from types import MappingProxyType
 from urllib.parse import urlencode
 
+import orjson
 import requests
 from django.conf import settings
 from django.middleware.csrf import get_token
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from oscar.apps.payment.exceptions import GatewayError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from ecommerce.extensions.payment.processors import BasePaymentProcessor, HandledProcessorResponse
 from ecommerce.extensions.payment.utils import clean_field_value
@@ -22,7 +27,18 @@ def format_price(price):
     """
     Return the price in the expected format.
     """
-    return '{:0.2f}'.format(price)
+    return f'{price:0.2f}'
+
+
+CART_ITEM_FIELDS = ('name', 'quantity', 'type', 'sku', 'price', 'currency', 'totalAmount')
+
+
+@lru_cache(maxsize=128)
+def get_cart_item_field_names(index):
+    """
+    Return the names of the cart fields of the basket line at the given index, in the order of `CART_ITEM_FIELDS`.
+    """
+    return tuple(f'cart.items[{index}].{field}' for field in CART_ITEM_FIELDS)
 
 
 class HyperPayException(GatewayError):
@@ -51,6 +67,9 @@ class HyperPay(BasePaymentProcessor):
     BILLING_ADDRESS_STREET2_MAX_LEN = 100
     BRANDS = "VISA MASTER"
     CHECKOUT_TEXT = _("Checkout with credit card")
+    # Connect and read timeouts, in seconds, for the requests to the HyperPay API.
+    REQUEST_TIMEOUT = (3.05, 10)
+    _session = None
 
     def __init__(self, site):
         super(HyperPay, self).__init__(site)
@@ -65,81 +84,103 @@ class HyperPay(BasePaymentProcessor):
         self.salt = configuration['salt']
         self.site = site
         self.pending_status_polling_interval = int(configuration.get('pending_status_polling_interval', 30))
+        # Read-only, since the same headers are passed to every request to HyperPay.
+        self._authentication_headers = MappingProxyType({
+            'Authorization': f'Bearer {self.access_token}'
+        })
+        self.checkouts_api_url = self.hyper_pay_api_base_url + self.CHECKOUTS_ENDPOINT
+        self.payment_widget_js_url = self.hyper_pay_api_base_url + self.PAYMENT_WIDGET_JS_PATH
+        self.entity_query = urlencode({'entityId': self.entity_id})
 
     @property
     def authentication_headers(self):
         """
         Return the authentication headers.
         """
-        return {
-            'Authorization': 'Bearer {}'.format(self.access_token)
-        }
+        return self._authentication_headers
+
+    @classmethod
+    def get_session(cls):
+        """
+        Return the HTTP session shared by all the requests to the HyperPay API.
+
+        Reusing the session keeps the connections to HyperPay alive between requests.
+        """
+        if HyperPay._session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(
+                pool_connections=10,
+                pool_maxsize=20,
+                max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+            ))
+            HyperPay._session = session
+        return HyperPay._session
 
     def _get_customer_profile_data(self, user, request):
         """
         Return the user profile data.
+
+        The data is cached on the request so that the account details of a user are
+        fetched only once per request, even if several checkouts are prepared.
         """
+        profile_data_cache = getattr(request, '_hyperpay_customer_profile_data', None)
+        if profile_data_cache is None:
+            profile_data_cache = request._hyperpay_customer_profile_data = {}  # pylint: disable=protected-access
+        if user.id in profile_data_cache:
+            return profile_data_cache[user.id]
 
-        def get_extended_profile_field(account_details, field_name, default_value=None):
-            """
-            Helper function to get the values of extended profile fields.
-            """
-            return next(
-                (
-                    field.get('field_value', default_value) for field in account_details['extended_profile']
-                    if field['field_name'] == field_name
-                ),
-                default_value
-            )
         user_account_details = user.account_details(request)
+        extended_profile = {
+            field['field_name']: field.get('field_value', '')
+            for field in user_account_details.get('extended_profile', [])
+        }
         data = {
             'customer.email': user.email,
         }
 
-        first_name = get_extended_profile_field(user_account_details, 'first_name', '')
+        first_name = extended_profile.get('first_name', '')
         if first_name:
             data['customer.givenName'] = first_name
-            data['customer.surname'] = get_extended_profile_field(user_account_details, 'last_name', '')
+            data['customer.surname'] = extended_profile.get('last_name', '')
         else:
             logger.warning('Unable to get the first name and last name for the user %s', user.username)
 
+        profile_data_cache[user.id] = data
         return data
 
     def _get_basket_data(self, basket):
         """
         Return the basket data
         """
-
-        def get_cart_field(index, name):
-            """
-            Return the cart field name.
-            """
-            return 'cart.items[{}].{}'.format(index, name)
+        # Local names are faster to look up in the loop below.
+        clean_value = clean_field_value
+        format_amount = format_price
+        currency = self.currency
+        cart_item_type = self.CART_ITEM_TYPE_DIGITAL
 
         basket_data = {
-            'amount': format_price(basket.total_incl_tax),
-            'currency': self.currency,
+            'amount': format_amount(basket.total_incl_tax),
+            'currency': currency,
             'merchantTransactionId': basket.order_number.replace("-", ""),
             'merchantMemo': basket.order_number,
         }
         for index, line in enumerate(basket.all_lines()):
-            cart_item = {
-                get_cart_field(index, 'name'): clean_field_value(line.product.title),
-                get_cart_field(index, 'quantity'): line.quantity,
-                get_cart_field(index, 'type'): self.CART_ITEM_TYPE_DIGITAL,
-                get_cart_field(index, 'sku'): line.stockrecord.partner_sku,
-                get_cart_field(index, 'price'): format_price(line.unit_price_incl_tax),
-                get_cart_field(index, 'currency'): self.currency,
-                get_cart_field(index, 'totalAmount'): format_price(line.line_price_incl_tax_incl_discounts)
-            }
-            basket_data.update(cart_item)
+            (
+                name_key, quantity_key, type_key, sku_key, price_key, currency_key, total_amount_key
+            ) = get_cart_item_field_names(index)
+            basket_data[name_key] = clean_value(line.product.title)
+            basket_data[quantity_key] = line.quantity
+            basket_data[type_key] = cart_item_type
+            basket_data[sku_key] = line.stockrecord.partner_sku
+            basket_data[price_key] = format_amount(line.unit_price_incl_tax)
+            basket_data[currency_key] = currency
+            basket_data[total_amount_key] = format_amount(line.line_price_incl_tax_incl_discounts)
         return basket_data
 
     def _get_checkout_data(self, basket, request):
         """
         Prepare the checkout and return the checkout data.
         """
-        checkouts_api_url = self.hyper_pay_api_base_url + self.CHECKOUTS_ENDPOINT
         request_data = {
             'entityId': self.entity_id,
             'paymentType': self.PAYMENT_TYPE,
@@ -152,15 +193,16 @@ class HyperPay(BasePaymentProcessor):
         request_data.update(self._get_customer_profile_data(basket.owner, request))
 
         try:
-            response = requests.post(
-                checkouts_api_url,
-                request_data,
-                headers=self.authentication_headers
+            response = self.get_session().post(
+                self.checkouts_api_url,
+                data=request_data,
+                headers=self.authentication_headers,
+                timeout=self.REQUEST_TIMEOUT
             )
         except Exception as exc:
             raise HyperPayException('Error creating a checkout. {}'.format(exc))
 
-        data = response.json()
+        data = orjson.loads(response.content)
         if 'result' not in data or 'code' not in data['result']:
             raise HyperPayException(
                 'Error creating checkout. Invalid response from HyperPay.'
@@ -178,7 +220,7 @@ class HyperPay(BasePaymentProcessor):
         """
         checkout_data = self._get_checkout_data(basket, request)
         payment_widget_js_url = '{}?{}'.format(
-            self.hyper_pay_api_base_url + self.PAYMENT_WIDGET_JS_PATH,
+            self.payment_widget_js_url,
             urlencode({'checkoutId': checkout_data['id']})
         )
         transaction_parameters = {
@@ -203,10 +245,7 @@ class HyperPay(BasePaymentProcessor):
         total = response.get('amount')
         transaction_id = response.get('id')
         card_data = response.get('card', {})
-        card_number = '{}XXXXXX{}'.format(
-            card_data.get('bin', 'XXXXXX'),
-            card_data.get('last4Digits', 'XXXX')
-        )
+        card_number = f"{card_data.get('bin', 'XXXXXX')}XXXXXX{card_data.get('last4Digits', 'XXXX')}"
         payment_type = response.get('paymentBrand', 'Unknown')
 
         return HandledProcessorResponse(
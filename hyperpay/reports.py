@@ -0,0 +1,65 @@
+"""
+Helpers for reporting HyperPay transactions that require manual verification.
+"""
+from oscar.core.loading import get_class
+
+from .processors import HyperPay, HyperPayMada
+from .result_codes import SUCCESS_MANUAL_REVIEW_CODES, SUCCESS_MANUAL_REVIEW_CODES_PREFIX
+
+PaymentProcessorResponse = get_class("payment.models", "PaymentProcessorResponse")
+
+REPORT_DURATION = 5
+# The longest duration, in hours, which can be requested for the report.
+REPORT_MAX_DURATION = 24 * 14
+REPORT_CHUNK_SIZE = 500
+
+
+def get_manual_review_result_code(response):
+    """
+    Return the result code of the stored HyperPay response if it requires manual verification, or None.
+    """
+    # The prefix may also be found in the other stored values, like the callback parameters or an error
+    # message, so the responses which do not have a result code are skipped.
+    result_code = response.get("result", {}).get("code")
+    if result_code in SUCCESS_MANUAL_REVIEW_CODES:
+        return result_code
+    return None
+
+
+def get_manual_review_candidates(since):
+    """
+    Return a queryset of the HyperPay responses created after `since` which may
+    require manual verification.
+
+    The exact result code of each response still has to be checked with `get_manual_review_result_code`.
+    """
+    return PaymentProcessorResponse.objects.filter(
+        processor_name__in=[HyperPay.NAME, HyperPayMada.NAME],
+        created__gte=since,
+        response__contains=SUCCESS_MANUAL_REVIEW_CODES_PREFIX,
+    )
+
+
+def iter_manual_review_records(since):
+    """
+    Yield the id, processor name and result code of the HyperPay responses
+    created after `since` which require manual verification.
+    """
+    past_responses = get_manual_review_candidates(since).values_list('id', 'processor_name', 'response')
+    for response_id, processor_name, response in past_responses.iterator(chunk_size=REPORT_CHUNK_SIZE):
+        result_code = get_manual_review_result_code(response)
+        if result_code is not None:
+            yield response_id, processor_name, result_code
+
+
+def get_manual_review_responses(since):
+    """
+    Return a queryset of the HyperPay responses created after `since` which may
+    require manual verification, along with their baskets.
+
+    The queryset is not filtered by the exact result code, so that it can be paginated
+    by the database. The responses of each page have to be checked with `get_manual_review_result_code`.
+    """
+    return get_manual_review_candidates(since).select_related('basket__owner').prefetch_related(
+        'basket__lines__product__course'
+    ).order_by('id')
@@ -0,0 +1,38 @@
+"""
+Classification of the result codes returned by HyperPay.
+
+The result codes are documented at https://hyperpay.docs.oppwa.com/reference/resultCodes
+"""
+
+# Prefixes of the result codes returned by HyperPay.
+SUCCESS_CODE_PREFIXES = ('000.000.', '000.100.1', '000.3', '000.6')
+PENDING_CHANGEABLE_SOON_CODE_PREFIXES = ('000.200',)
+PENDING_NOT_CHANGEABLE_SOON_CODE_PREFIXES = ('800.400.5', '100.400.500')
+# Hyperpay result codes for manual review can be found at
+# https://hyperpay.docs.oppwa.com/reference/resultCodes#successful under the section
+# "Result codes for successfully processed transactions that should be manually reviewed"
+# and are matched by the pattern ^(000\.400\.0[^3]|000\.400\.[0-1]{2}0). Result codes always have the
+# format NNN.NNN.NNN, so the pattern is expanded to the exact set of codes it accepts.
+SUCCESS_MANUAL_REVIEW_CODES = frozenset(
+    [f'000.400.0{second}{third}' for second in '012456789' for third in '0123456789'] +
+    [f'000.400.{first}{second}0' for first in '01' for second in '01']
+)
+# Common prefix of all the above result codes. The response is stored as serialized JSON, so this
+# substring is used to discard most of the records in the database before checking the exact code.
+SUCCESS_MANUAL_REVIEW_CODES_PREFIX = '000.400.'
+
+
+def classify_result_code(result_code):
+    """
+    Return the group of the HyperPay result code, or None if the code is a rejection.
+    """
+    # Successful payments are the most common case, so they are checked first.
+    if result_code.startswith(SUCCESS_CODE_PREFIXES):
+        return 'success'
+    if result_code in SUCCESS_MANUAL_REVIEW_CODES:
+        return 'success_manual_review'
+    if result_code.startswith(PENDING_CHANGEABLE_SOON_CODE_PREFIXES):
+        return 'pending_changeable_soon'
+    if result_code.startswith(PENDING_NOT_CHANGEABLE_SOON_CODE_PREFIXES):
+        return 'pending_not_changeable_soon'
+    return None
@@ -116,6 +116,22 @@ class HyperPayTests(HyperPayMixin, PaymentProcessorTestCaseMixin, TestCase):
             self.processor._get_checkout_id(self.basket, self.request)  # pylint: disable=protected-access
         self.assertEqual(exc.exception.args[0], 'Error creating checkout. Invalid response from HyperPay.')
 
+    @patch('ecommerce.core.models.User.account_details')
+    def test__get_customer_profile_data_is_cached_per_request(self, mock_account_details):
+        """
+        Test that the account details of the user are fetched only once per request.
+        """
+        mock_account_details.return_value = self.DEFAULT_USER_ACCOUNT_DETAILS
+        expected_profile_data = dict(self.DEFAULT_CUSTOMER_PROFILE_DATA, **{'customer.email': self.basket.owner.email})
+
+        for _ in range(2):
+            profile_data = self.processor._get_customer_profile_data(  # pylint: disable=protected-access
+                self.basket.owner,
+                self.request
+            )
+            self.assertEqual(profile_data, expected_profile_data)
+        mock_account_details.assert_called_once_with(self.request)
+
     @responses.activate
     @patch('hyperpay.processors.get_token')
     @patch('ecommerce.core.models.User.account_details')
@@ -0,0 +1,76 @@
+import re
+
+import ddt
+from django.test import SimpleTestCase
+
+from hyperpay.result_codes import SUCCESS_MANUAL_REVIEW_CODES, classify_result_code
+
+# The patterns of the result codes documented at https://hyperpay.docs.oppwa.com/reference/resultCodes
+DOCUMENTED_PATTERNS = {
+    'success': re.compile(r'^(000\.000\.|000\.100\.1|000\.[36])'),
+    'success_manual_review': re.compile(r'^(000\.400\.0[^3]|000\.400\.[0-1]{2}0)'),
+    'pending_changeable_soon': re.compile(r'^(000\.200)'),
+    'pending_not_changeable_soon': re.compile(r'^(800\.400\.5|100\.400\.500)'),
+}
+
+
+def classify_with_documented_patterns(result_code):
+    """
+    Return the group of the result code according to the documented patterns, or None for rejections.
+    """
+    for group, pattern in DOCUMENTED_PATTERNS.items():
+        if pattern.search(result_code):
+            return group
+    return None
+
+
+@ddt.ddt
+class ResultCodesTests(SimpleTestCase):
+    """
+    Tests for the classification of the HyperPay result codes.
+    """
+
+    @ddt.data(
+        ('000.000.000', 'success'),
+        ('000.100.110', 'success'),
+        ('000.300.000', 'success'),
+        ('000.600.000', 'success'),
+        ('000.400.000', 'success_manual_review'),
+        ('000.400.110', 'success_manual_review'),
+        ('000.200.100', 'pending_changeable_soon'),
+        ('800.400.500', 'pending_not_changeable_soon'),
+        ('100.400.500', 'pending_not_changeable_soon'),
+        ('000.400.030', None),
+        ('000.100.200', None),
+        ('800.100.100', None),
+        ('100.400.501', None),
+    )
+    @ddt.unpack
+    def test_classify_result_code(self, result_code, group):
+        """
+        Test that the result codes are classified in their documented group.
+        """
+        self.assertEqual(classify_result_code(result_code), group)
+
+    def test_classify_result_code_matches_documented_patterns(self):
+        """
+        Test that all the codes which may belong to a group are classified as the documented patterns do.
+        """
+        for first in ('000', '100', '200', '800', '900'):
+            for second in range(1000):
+                prefix = f'{first}.{second:03d}.'
+                codes = [f'{prefix}{third:03d}' for third in range(1000)]
+                self.assertEqual(
+                    [classify_result_code(code) for code in codes],
+                    [classify_with_documented_patterns(code) for code in codes],
+                    prefix
+                )
+
+    def test_manual_review_codes_match_documented_pattern(self):
+        """
+        Test that the manual review codes are exactly the codes matched
+        by the pattern documented by HyperPay.
+        """
+        pattern = DOCUMENTED_PATTERNS['success_manual_review']
+        codes = ['000.400.{:03d}'.format(number) for number in range(1000)]
+        self.assertEqual(SUCCESS_MANUAL_REVIEW_CODES, {code for code in codes if pattern.search(code)})
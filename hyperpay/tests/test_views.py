@@ -0,0 +1,247 @@
+import re
+
+import ddt
+import requests
+import responses
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.urls import reverse
+
+from ecommerce.extensions.payment.models import PaymentProcessorResponse
+from ecommerce.tests.testcases import TestCase
+from hyperpay.processors import HyperPay, HyperPayMada
+from hyperpay.reports import REPORT_DURATION
+from hyperpay.tests.mixins import HyperPayMixin
+from hyperpay.views import HyperPayResponseView, PaymentStatus, sign_string, unsign_string
+
+
+@ddt.ddt
+class HyperPayManualReviewReportViewTests(TestCase):
+    """
+    Tests for the view listing the payments which require manual verification.
+    """
+
+    def setUp(self):
+        super(HyperPayManualReviewReportViewTests, self).setUp()
+        self.path = reverse('hyperpay:manual-review-report')
+        self.manual_review_response = PaymentProcessorResponse.objects.create(
+            processor_name=HyperPayMada.NAME,
+            response={"result": {"code": "000.400.000"}}
+        )
+        PaymentProcessorResponse.objects.create(
+            processor_name=HyperPay.NAME,
+            response={"result": {"code": "000.000.000"}}
+        )
+        # This code has the prefix of the manual review codes, but does not require manual verification.
+        PaymentProcessorResponse.objects.create(
+            processor_name=HyperPay.NAME,
+            response={"result": {"code": "000.400.030"}}
+        )
+
+    def test_non_staff_user_is_denied(self):
+        """
+        Test that only staff users can access the report.
+        """
+        user = self.create_user()
+        self.client.login(username=user.username, password=self.password)
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 403)
+
+    def test_manual_review_responses_are_listed(self):
+        """
+        Test that only the payments requiring manual verification are listed.
+        """
+        user = self.create_user(is_staff=True)
+        self.client.login(username=user.username, password=self.password)
+        response = self.client.get(self.path, {'duration': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['duration'], 10)
+        self.assertEqual(list(response.context['responses']), [self.manual_review_response])
+
+    @ddt.data('abc', '0', '-1', '1000000000', '1' + '0' * 30)
+    def test_invalid_duration_falls_back_to_default(self, duration):
+        """
+        Test that a duration which is not a number of hours in the allowed range is replaced by the default one.
+        """
+        user = self.create_user(is_staff=True)
+        self.client.login(username=user.username, password=self.password)
+        response = self.client.get(self.path, {'duration': duration})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['duration'], REPORT_DURATION)
+
+
+class HyperPayPaymentPageViewTests(TestCase):
+    """
+    Tests for the view rendering the HyperPay payment form.
+    """
+    # The fields posted by the form built from `HyperPay.get_transaction_parameters`.
+    transaction_parameters = {
+        'payment_widget_js': 'https://test.oppwa.com/v1/paymentWidgets.js?checkoutId=123456789',
+        'payment_page_url': '/payment/hyperpay/pay/',
+        'payment_result_url': '/payment/hyperpay/submit/',
+        'brands': 'VISA MASTER',
+        'payment_mode': 'Credit card',
+        'locale': 'en',
+        'integrity': 'sha384-integrity',
+        'hyper_pay_api_base_url': 'https://test.oppwa.com',
+        'extra_hosts_content_security_policy': 'https://extra.example.com',
+    }
+
+    def test_payment_form_is_rendered_with_transaction_parameters(self):
+        """
+        Test that the posted transaction parameters and the nonce are rendered in the page.
+        """
+        user = self.create_user()
+        self.client.login(username=user.username, password=self.password)
+        response = self.client.post(reverse('hyperpay:payment-form'), self.transaction_parameters)
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode('utf-8')
+
+        nonce_match = re.search(r"'nonce-([0-9a-f]{32})'", content)
+        self.assertIsNotNone(nonce_match)
+        self.assertIn('nonce="{}"'.format(nonce_match.group(1)), content)
+        self.assertIn(
+            "script-src 'self' https://test.oppwa.com https://extra.example.com 'nonce-{}'".format(
+                nonce_match.group(1)
+            ),
+            content
+        )
+        self.assertIn(
+            '<script src="https://test.oppwa.com/v1/paymentWidgets.js?checkoutId=123456789" '
+            'integrity="sha384-integrity" crossorigin="anonymous"></script>',
+            content
+        )
+        self.assertIn('locale: "en"', content)
+        self.assertIn('action="/payment/hyperpay/submit/" class="paymentWidgets" data-brands="VISA MASTER"', content)
+
+
+@ddt.ddt
+class HyperPayResponseViewTests(HyperPayMixin, TestCase):
+    """
+    Tests for the view handling the response from HyperPay.
+    """
+    resource_path = '/v1/checkouts/123456789/payment'
+
+    def setUp(self):
+        super(HyperPayResponseViewTests, self).setUp()
+        cache.clear()
+        self.view = HyperPayResponseView()
+        self.view.request = RequestFactory().get('/')
+        self.view.request.site = self.site
+
+    @responses.activate
+    def test_pending_status_is_cached(self):
+        """
+        Test that a pending status is reused instead of asking HyperPay again.
+        """
+        body = {'result': {'code': '000.200.100'}, 'id': '123456789'}
+        self.mock_api_response(self.resource_path, body, method=responses.GET)
+        # pylint: disable=protected-access
+        self.assertEqual(self.view._verify_status(self.resource_path), (body, PaymentStatus.PENDING))
+        self.assertEqual(self.view._verify_status(self.resource_path), (body, PaymentStatus.PENDING))
+        self.assertEqual(len(responses.calls), 1)
+
+    @ddt.data(('000.000.000', PaymentStatus.SUCCESS), ('800.100.100', PaymentStatus.FAILURE))
+    @ddt.unpack
+    @responses.activate
+    def test_final_status_is_not_cached(self, code, status):
+        """
+        Test that a successful or failed payment is always verified with HyperPay.
+        """
+        body = {'result': {'code': code}, 'id': '123456789'}
+        self.mock_api_response(self.resource_path, body, method=responses.GET)
+        # pylint: disable=protected-access
+        self.assertEqual(self.view._verify_status(self.resource_path), (body, status))
+        self.assertEqual(self.view._verify_status(self.resource_path), (body, status))
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_error_status_code_is_a_failure(self):
+        """
+        Test that an error response which is not retried is treated as a failure and its body is kept.
+        """
+        responses.add(
+            responses.GET, self._create_api_url(path=self.resource_path), status=400, body='Bad Request'
+        )
+        # pylint: disable=protected-access
+        self.assertEqual(
+            self.view._verify_status(self.resource_path),
+            ({'status_code': 400, 'error': 'Bad Request'}, PaymentStatus.FAILURE)
+        )
+
+    @ddt.data(requests.exceptions.RetryError('Max retries exceeded'), requests.exceptions.Timeout('Timed out'))
+    @responses.activate
+    def test_request_error_is_a_failure(self, error):
+        """
+        Test that an error while requesting the payment status from HyperPay is treated as a failure.
+        """
+        responses.add(responses.GET, self._create_api_url(path=self.resource_path), body=error)
+        # pylint: disable=protected-access
+        self.assertEqual(
+            self.view._verify_status(self.resource_path),
+            ({'error': str(error)}, PaymentStatus.FAILURE)
+        )
+
+    def test_sign_string_round_trip(self):
+        """
+        Test that a signed resource path can be read back, but not with another salt.
+        """
+        processor = self.view.payment_processor
+        signed_resource_path = sign_string(self.resource_path, processor.encryption_key, processor.salt)
+        self.assertEqual(
+            unsign_string(signed_resource_path, processor.encryption_key, processor.salt), self.resource_path
+        )
+        self.assertIsNone(unsign_string(signed_resource_path, processor.encryption_key, 'another-salt'))
+
+    def test_signed_resource_path_matches_status_check_route(self):
+        """
+        Test that the signed resource path can be used in the status check URL.
+        """
+        processor = self.view.payment_processor
+        signed_resource_path = sign_string(self.resource_path, processor.encryption_key, processor.salt)
+        path = reverse('hyperpay:status-check', kwargs={'signed_resource_path': signed_resource_path})
+        self.assertIn(signed_resource_path, path)
+
+    @ddt.data(False, True)
+    def test_invalid_signed_resource_path_is_an_error(self, tampered):
+        """
+        Test that a garbage or tampered signed resource path redirects to the payment error page.
+        """
+        signed_resource_path = 'garbage'
+        if tampered:
+            processor = self.view.payment_processor
+            signed = sign_string(self.resource_path, processor.encryption_key, processor.salt)
+            signed_resource_path = signed[:-1] + ('B' if signed.endswith('A') else 'A')
+        path = reverse('hyperpay:status-check', kwargs={'signed_resource_path': signed_resource_path})
+        with self.assertLogs('hyperpay.views', level='ERROR'):
+            response = self.client.get(path)
+        self.assertRedirects(response, reverse('payment_error'), fetch_redirect_response=False)
+        self.assertFalse(PaymentProcessorResponse.objects.exists())
+
+    @responses.activate
+    def test_callback_is_recorded_once(self):
+        """
+        Test that the first callback writes a single record with the payment status and the callback parameters.
+        """
+        body = {'result': {'code': '800.100.100'}, 'id': '123456789', 'merchantTransactionId': 'EDX-100001'}
+        self.mock_api_response(self.resource_path, body, method=responses.GET)
+        callback_parameters = {'id': '123456789', 'resourcePath': self.resource_path}
+        response = self.client.get(reverse('hyperpay:submit'), callback_parameters)
+        self.assertRedirects(response, reverse('payment_error'), fetch_redirect_response=False)
+
+        ppr = PaymentProcessorResponse.objects.get(processor_name=HyperPay.NAME)
+        self.assertEqual(ppr.transaction_id, 'EDX-100001')
+        self.assertEqual(ppr.response, dict(body, callback_get=callback_parameters))
+
+    def test_invalid_callback_is_recorded(self):
+        """
+        Test that a callback without a resource path writes a record with only the callback parameters.
+        """
+        with self.assertLogs('hyperpay.views', level='ERROR'):
+            response = self.client.get(reverse('hyperpay:submit'), {'id': '123456789'})
+        self.assertRedirects(response, reverse('payment_error'), fetch_redirect_response=False)
+
+        ppr = PaymentProcessorResponse.objects.get(processor_name=HyperPay.NAME)
+        self.assertEqual(ppr.transaction_id, '123456789')
+        self.assertNotIn('callback_get', ppr.response)
+        self.assertNotIn('result', ppr.response)
@@ -1,22 +1,24 @@
 """
 Defines the URL routes for the hyperpay app.
 """
-from django.conf.urls import url
+from django.urls import re_path
 
-from .views import HyperPayMadaResponseView, HyperPayPaymentPageView, HyperPayResponseView
+from .views import (HyperPayMadaResponseView, HyperPayManualReviewReportView, HyperPayPaymentPageView,
+                    HyperPayResponseView)
 
 urlpatterns = [
-    url(r'^payment/hyperpay/pay/$', HyperPayPaymentPageView.as_view(), name='payment-form'),
-    url(r'^payment/hyperpay/submit/$', HyperPayResponseView.as_view(), name='submit'),
-    url(
-        r'^payment/hyperpay/status/(?P<encrypted_resource_path>.+)/$',
+    re_path(r'^payment/hyperpay/pay/$', HyperPayPaymentPageView.as_view(), name='payment-form'),
+    re_path(r'^payment/hyperpay/submit/$', HyperPayResponseView.as_view(), name='submit'),
+    re_path(
+        r'^payment/hyperpay/status/(?P<signed_resource_path>[A-Za-z0-9_:-]+)/$',
         HyperPayResponseView.as_view(),
         name='status-check'
     ),
-    url(r'^payment/hyperpay/mada/submit/$', HyperPayMadaResponseView.as_view(), name='mada-submit'),
-    url(
-        r'^payment/hyperpay/mada/status/(?P<encrypted_resource_path>.+)/$',
+    re_path(r'^payment/hyperpay/mada/submit/$', HyperPayMadaResponseView.as_view(), name='mada-submit'),
+    re_path(
+        r'^payment/hyperpay/mada/status/(?P<signed_resource_path>[A-Za-z0-9_:-]+)/$',
         HyperPayMadaResponseView.as_view(),
         name='mada-status-check'
     ),
+    re_path(r'^payment/hyperpay/report/$', HyperPayManualReviewReportView.as_view(), name='manual-review-report'),
 ]
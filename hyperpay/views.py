@@ -2,27 +2,28 @@
 Views related to the HyperPay payment processor.
 """
 
-import base64
+import datetime
+import hashlib
 import logging
-import re
+import secrets
 from enum import Enum
-from urllib.parse import urlencode
-import uuid
 
+import orjson
 import requests
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core import signing
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 from django.http import Http404
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic import View
+from django.views.generic import ListView, View
 from oscar.apps.partner import strategy
 from oscar.core.loading import get_class, get_model
 
@@ -30,6 +31,8 @@ from ecommerce.extensions.checkout.mixins import EdxOrderPlacementMixin
 from ecommerce.extensions.checkout.utils import get_receipt_page_url
 
 from .processors import HyperPay, HyperPayMada
+from .reports import REPORT_DURATION, REPORT_MAX_DURATION, get_manual_review_responses, get_manual_review_result_code
+from .result_codes import classify_result_code
 
 logger = logging.getLogger(__name__)
 
@@ -38,34 +41,21 @@ Basket = get_model('basket', 'Basket')
 OrderNumberGenerator = get_class('order.utils', 'OrderNumberGenerator')
 
 
-def generate_key(encryption_key, salt):
+def sign_string(message, encryption_key, salt):
     """
-    Generate the encryption key.
+    Sign the string, returning a URL-safe token which contains it.
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        iterations=100000,
-        salt=salt.encode(),
-        backend=default_backend()
-    )
-    return base64.urlsafe_b64encode(kdf.derive(encryption_key.encode()))
+    return signing.dumps(message, key=encryption_key, salt=salt)
 
 
-def encrypt_string(message, encryption_key, salt):
+def unsign_string(signed_message, encryption_key, salt):
     """
-    Encrypt the string.
+    Return the string contained in the signed token, or None if the signature is not valid.
     """
-    fernet = Fernet(generate_key(encryption_key, salt))
-    return fernet.encrypt(message.encode()).decode('utf-8')
-
-
-def decrypt_string(encrypted_message, encryption_key, salt):
-    """
-    Decrypt the encrypted string.
-    """
-    fernet = Fernet(generate_key(encryption_key, salt))
-    return fernet.decrypt(encrypted_message.encode()).decode('utf-8')
+    try:
+        return signing.loads(signed_message, key=encryption_key, salt=salt)
+    except signing.BadSignature:
+        return None
 
 
 class PaymentStatus(Enum):
@@ -74,6 +64,39 @@ class PaymentStatus(Enum):
     FAILURE = 2
 
 
+# The log level, the log message and the payment status for each group returned by `classify_result_code`.
+RESULT_CODE_HANDLING = {
+    'pending_changeable_soon': (
+        logging.WARNING,
+        'Received a pending status code %s from HyperPay for payment id %s.',
+        PaymentStatus.PENDING,
+    ),
+    'pending_not_changeable_soon': (
+        logging.WARNING,
+        'Received a pending status code %s from HyperPay for payment id %s. As this can change '
+        'after several days, treating it as a failure.',
+        PaymentStatus.FAILURE,
+    ),
+    'success': (
+        logging.INFO,
+        'Received a success status code %s from HyperPay for payment id %s.',
+        PaymentStatus.SUCCESS,
+    ),
+    # This is treated as a failure till we get clarity on whether it should be treated as a success.
+    'success_manual_review': (
+        logging.ERROR,
+        'Received a success status code %s from HyperPay which requires manual verification for payment id %s. '
+        'Treating it as a failed transaction.',
+        PaymentStatus.FAILURE,
+    ),
+    None: (
+        logging.ERROR,
+        'Received a rejection status code %s from HyperPay for payment id %s',
+        PaymentStatus.FAILURE,
+    ),
+}
+
+
 class HyperPayPaymentPageView(View):
     """
     Render the template which loads the HyperPay payment form via JavaScript
@@ -84,8 +107,10 @@ class HyperPayPaymentPageView(View):
         """
         Handles the POST request.
         """
-        context = request.POST.dict()
-        context["nonce_id"] = str(uuid.uuid4())
+        context = {
+            'nonce_id': secrets.token_hex(16),
+            'form': request.POST,
+        }
         return render(request, self.template_name, context)
 
 
@@ -95,16 +120,18 @@ class HyperPayResponseView(EdxOrderPlacementMixin, View):
 
     The result codes returned by HyperPay are documented at https://hyperpay.docs.oppwa.com/reference/resultCodes
     """
-    SUCCESS_CODES_REGEX = re.compile(r'^(000\.000\.|000\.100\.1|000\.[36])')
-    SUCCESS_MANUAL_REVIEW_CODES_REGEX = re.compile(r'^(000\.400\.0[^3]|000\.400\.[0-1]{2}0)')
-    PENDING_CHANGEABLE_SOON_CODES_REGEX = re.compile(r'^(000\.200)')
-    PENDING_NOT_CHANGEABLE_SOON_CODES_REGEX = re.compile(r'^(800\.400\.5|100\.400\.500)')
+    PAYMENT_PROCESSOR_CLASS = HyperPay
     PENDING_STATUS_URL_NAME = 'hyperpay:status-check'
     PENDING_STATUS_PAGE_TITLE = _('HyperPay - Credit card - pending')
+    # A pending status is reused for the same payment for this many seconds less than the polling interval
+    # of the pending page, so that each automatic refresh of the page asks HyperPay again, while manual reloads
+    # and other tabs polling the same payment in between are served from the cache.
+    PENDING_STATUS_CACHE_MARGIN = 1
 
-    @property
+    @cached_property
     def payment_processor(self):
-        return HyperPay(self.request.site)
+        # A view instance only serves a single request, so the processor is built once per request.
+        return self.PAYMENT_PROCESSOR_CLASS(self.request.site)
 
     @method_decorator(transaction.non_atomic_requests)
     @method_decorator(csrf_exempt)
@@ -127,94 +154,89 @@ class HyperPayResponseView(EdxOrderPlacementMixin, View):
         except (ValueError, ObjectDoesNotExist):
             return None
 
+    def _get_pending_status_cache_key(self, resource_path):
+        """
+        Get the cache key of the pending status of the payment.
+        """
+        resource_path_hash = hashlib.sha256(resource_path.encode('utf-8')).hexdigest()
+        return f'hyperpay_pending_status_{self.payment_processor.NAME}_{resource_path_hash}'
+
     def _verify_status(self, resource_path):
         """
         Verify the status of the payment.
+
+        Only pending statuses are cached, a successful or failed payment is always verified with HyperPay.
         """
-        status = PaymentStatus.SUCCESS
-        payment_status_endpoint = "{}?{}".format(
-            self.payment_processor.hyper_pay_api_base_url + resource_path,
-            urlencode({'entityId': self.payment_processor.configuration['entity_id']})
+        cache_key = self._get_pending_status_cache_key(resource_path)
+        cached_response_data = cache.get(cache_key)
+        if cached_response_data is not None:
+            return cached_response_data, PaymentStatus.PENDING
+
+        payment_processor = self.payment_processor
+        payment_status_endpoint = (
+            f'{payment_processor.hyper_pay_api_base_url}{resource_path}?{payment_processor.entity_query}'
         )
-        response = requests.get(payment_status_endpoint, headers=self.payment_processor.authentication_headers)
-        response_data = response.json()
-
-        result_code = response_data['result']['code']
-        if not response.ok:
-            logger.error('Received a non-success response status code from HyperPay %s', response.status_code)
-            status = PaymentStatus.FAILURE
-        elif self.PENDING_CHANGEABLE_SOON_CODES_REGEX.search(result_code):
-            logger.warning(
-                'Received a pending status code %s from HyperPay for payment id %s.',
-                result_code,
-                response_data['id']
-            )
-            status = PaymentStatus.PENDING
-        elif self.PENDING_NOT_CHANGEABLE_SOON_CODES_REGEX.search(result_code):
-            logger.warning(
-                'Received a pending status code %s from HyperPay for payment id %s. As this can change '
-                'after several days, treating it as a failure.',
-                result_code,
-                response_data['id']
-            )
-            status = PaymentStatus.FAILURE
-        elif self.SUCCESS_CODES_REGEX.search(result_code):
-            logger.info(
-                'Received a success status code %s from HyperPay for payment id %s.',
-                result_code,
-                response_data['id']
+        try:
+            response = payment_processor.get_session().get(
+                payment_status_endpoint,
+                headers=payment_processor.authentication_headers,
+                timeout=payment_processor.REQUEST_TIMEOUT
             )
-        elif self.SUCCESS_MANUAL_REVIEW_CODES_REGEX.search(result_code):
+        except requests.RequestException as exc:
+            # This includes the timeouts, the connection errors and the retries exhausted on 502/503/504.
+            logger.error('Failed to get the payment status from HyperPay: %s', exc)
+            return {'error': str(exc)}, PaymentStatus.FAILURE
+        if not response.ok:
             logger.error(
-                'Received a success status code %s from HyperPay which requires manual verification for payment id %s.'
-                'Treating it as a failed transaction.',
-                result_code,
-                response_data['id']
+                'Received a non-success response status code from HyperPay %s: %s',
+                response.status_code,
+                response.text
             )
+            # The body is not parsed, but it is kept in the recorded response as evidence of the error.
+            return {'status_code': response.status_code, 'error': response.text}, PaymentStatus.FAILURE
 
-            # This is a temporary change till we get clarity on whether this should be treated as a failure.
-            status = PaymentStatus.FAILURE
-        else:
-            logger.error(
-                'Received a rejection status code %s from HyperPay for payment id %s',
-                result_code,
-                response_data['id']
-            )
-            status = PaymentStatus.FAILURE
+        response_data = orjson.loads(response.content)
+        result_code = response_data['result']['code']
+        log_level, log_message, status = RESULT_CODE_HANDLING[classify_result_code(result_code)]
+        logger.log(log_level, log_message, result_code, response_data.get('id', 'id-not-found'))
 
+        cache_timeout = payment_processor.pending_status_polling_interval - self.PENDING_STATUS_CACHE_MARGIN
+        if status == PaymentStatus.PENDING and cache_timeout > 0:
+            cache.set(cache_key, response_data, cache_timeout)
         return response_data, status
 
-    def _handle_pending_status(self, request, encrypted_resource_path, resource_path):
+    def _handle_pending_status(self, request, signed_resource_path, resource_path):
         """
         Handles the pending status.
         """
-        encrypted_resource_path_value = encrypt_string(
-            resource_path,
-            self.payment_processor.encryption_key,
-            self.payment_processor.salt
-        )
+        payment_processor = self.payment_processor
         context = {
             'title': self.PENDING_STATUS_PAGE_TITLE,
-            'interval': self.payment_processor.pending_status_polling_interval
+            'interval': payment_processor.pending_status_polling_interval
         }
-        if encrypted_resource_path is not None:
+        if signed_resource_path is not None:
             return render(request, 'payment/hyperpay_pending.html', context)
 
+        signed_resource_path_value = sign_string(
+            resource_path,
+            payment_processor.encryption_key,
+            payment_processor.salt
+        )
         request.session['hyperpay_dont_check_status'] = True
         return redirect(
             reverse(
                 self.PENDING_STATUS_URL_NAME,
-                kwargs={'encrypted_resource_path': encrypted_resource_path_value}
+                kwargs={'signed_resource_path': signed_resource_path_value}
             )
         )
 
-    def _get_resource_path(self, request, encrypted_resource_path):
+    def _get_resource_path(self, request, signed_resource_path):
         """
         Get the resource_path for checking the payment status.
         """
-        if encrypted_resource_path is not None:
-            resource_path = decrypt_string(
-                encrypted_resource_path,
+        if signed_resource_path is not None:
+            resource_path = unsign_string(
+                signed_resource_path,
                 self.payment_processor.encryption_key,
                 self.payment_processor.salt
             )
@@ -232,20 +254,20 @@ class HyperPayResponseView(EdxOrderPlacementMixin, View):
             del request.session['hyperpay_dont_check_status']
         return check_status
 
-    def get(self, request, encrypted_resource_path=None):
+    def get(self, request, signed_resource_path=None):
         """
         Handle the response from HyperPay and redirect to the appropriate page based on the status.
         """
-        if encrypted_resource_path is None:
-            self.payment_processor.record_processor_response(request.GET, transaction_id=request.GET.get('id'))
-
+        payment_processor = self.payment_processor
         verification_response = ''
         basket = None
         transaction_id = 'Unknown'
 
-        resource_path = self._get_resource_path(request, encrypted_resource_path)
+        resource_path = self._get_resource_path(request, signed_resource_path)
         if resource_path is None:
             logger.error('Received an invalid response from HyperPay')
+            if signed_resource_path is None:
+                payment_processor.record_processor_response(request.GET, transaction_id=request.GET.get('id'))
             return redirect(reverse('payment_error'))
 
         check_status = self._get_check_status(request)
@@ -261,7 +283,7 @@ class HyperPayResponseView(EdxOrderPlacementMixin, View):
             if status == PaymentStatus.FAILURE:
                 return redirect(reverse('payment_error'))
             if status == PaymentStatus.PENDING:
-                return self._handle_pending_status(request, encrypted_resource_path, resource_path)
+                return self._handle_pending_status(request, signed_resource_path, resource_path)
 
             basket_id = OrderNumberGenerator().basket_id(verification_response['merchantMemo'])
             basket = self._get_basket(basket_id)
@@ -280,8 +302,17 @@ class HyperPayResponseView(EdxOrderPlacementMixin, View):
                 )
                 raise Http404
         finally:
-            payment_processor_response = self.payment_processor.record_processor_response(
-                verification_response,
+            recorded_response = verification_response
+            if signed_resource_path is None:
+                # The parameters HyperPay redirected the user with are recorded along with the payment status,
+                # so that a single record is written for the callback. A new dict is built, so that the
+                # response handled below stays the one returned by HyperPay.
+                recorded_response = {
+                    **(verification_response or {}),
+                    'callback_get': request.GET.dict(),
+                }
+            payment_processor_response = payment_processor.record_processor_response(
+                recorded_response,
                 transaction_id=transaction_id,
                 basket=basket
             )
@@ -318,9 +349,45 @@ class HyperPayMadaResponseView(HyperPayResponseView):
     """
     Handle the response from HyperPay after processing the mada payment.
     """
+    PAYMENT_PROCESSOR_CLASS = HyperPayMada
     PENDING_STATUS_URL_NAME = 'hyperpay:mada-status-check'
     PENDING_STATUS_PAGE_TITLE = _('HyperPay - mada - pending')
 
+
+class HyperPayManualReviewReportView(UserPassesTestMixin, ListView):
+    """
+    List the HyperPay payments of the past N hours which require manual verification.
+    """
+    template_name = 'payment/hyperpay_manual_review_report.html'
+    context_object_name = 'responses'
+    paginate_by = 50
+
+    def test_func(self):
+        return self.request.user.is_staff
+
     @property
-    def payment_processor(self):
-        return HyperPayMada(self.request.site)
+    def duration(self):
+        """
+        Return the number of hours to look back, as passed in the `duration` query parameter.
+
+        Fall back to the default duration if the parameter is not between 1 and REPORT_MAX_DURATION.
+        """
+        try:
+            duration = int(self.request.GET.get('duration', REPORT_DURATION))
+        except ValueError:
+            return REPORT_DURATION
+        if not 1 <= duration <= REPORT_MAX_DURATION:
+            return REPORT_DURATION
+        return duration
+
+    def get_queryset(self):
+        return get_manual_review_responses(now() - datetime.timedelta(hours=self.duration))
+
+    def get_context_data(self, **kwargs):
+        context = super(HyperPayManualReviewReportView, self).get_context_data(**kwargs)
+        # Only the responses of the current page are checked for their exact result code.
+        context['responses'] = [
+            response for response in context['responses'] if get_manual_review_result_code(response.response)
+        ]
+        context['duration'] = self.duration
+        return context
@@ -1,8 +1,6 @@
 """
 Setup file for the ecommerce-hyperpay Open edX ecommerce payment processor backend plugin.
 """
-import os
-
 from pathlib import Path
 
 from setuptools import setup
@@ -19,9 +17,7 @@ def package_data(pkg, roots):
     """
     data = []
     for root in roots:
-        for dirname, _, files in os.walk(os.path.join(pkg, root)):
-            for fname in files:
-                data.append(os.path.relpath(os.path.join(dirname, fname), pkg))
+        data.extend(str(path.relative_to(pkg)) for path in Path(pkg, root).rglob('*') if path.is_file())
 
     return {pkg: data}
 
@@ -50,6 +46,7 @@ setup(
     ],
     install_requires=[
         'Django~=3.2',
+        'orjson',
     ],
     package_data=package_data('hyperpay', ['locale']),
     packages=[